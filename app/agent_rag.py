@@ -13,149 +13,352 @@
 # limitations under the License.
 
 # mypy: disable-error-code="union-attr"
-from langchain_core.messages import BaseMessage, AIMessage
+import functools
+import time
+import uuid
+from collections import deque
+from typing import Any
+
+import numpy as np
+from langchain_core.messages import AIMessage, BaseMessage
 from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
 from langgraph.graph import END, MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode
-from google.cloud import aiplatform
-from google.cloud.aiplatform import generative_models
-from google.cloud.aiplatform.rag import rag
-
+from vertexai import generative_models
 
 LOCATION = "us-central1"
 LLM_LOCATION = "us-east5"
 LLM = "claude-3-7-sonnet@20250219"
 
 
-# Note: We're not explicitly initializing Vertex AI here to be consistent with app/agent.py
-# If you encounter initialization errors, you may need to add:
-# aiplatform.init(project='your-project-id', location=LLM_LOCATION)
+# Vertex AI is initialized lazily, once per process, the first time the model
+# is actually invoked. Claude is served out of LLM_LOCATION, so that is the
+# location the SDK is pointed at.
+_INITIALIZED = False
+
+
+def _ensure_init() -> None:
+    """Runs aiplatform.init exactly once per process."""
+    global _INITIALIZED
+    if _INITIALIZED:
+        return
+    from google.cloud import aiplatform
+
+    aiplatform.init(location=LLM_LOCATION)
+    _INITIALIZED = True
+
 
 # 1. Define tools
 
-# Get RAG corpus
-rag_corpus = rag.RagCorpus(f"projects/qwiklabs-gcp-00-ec45a6172538/locations/${LOCATION}/ragCorpora/4611686018427387904")
-
-# Create RAG retrieval tool
-rag_retrieval_tool = generative_models.Tool.from_retrieval(
-    retrieval=rag.Retrieval(
-        source=rag.VertexRagStore(
-            rag_resources=[rag.RagResource(rag_corpus=rag_corpus.name)],
-            rag_retrieval_config=rag.RagRetrievalConfig(
-                top_k=10,  # Optional
-                filter=rag.Filter(
-                    vector_distance_threshold=0.5,  # Optional
+
+@functools.lru_cache(maxsize=1)
+def _rag_retrieval_tool() -> generative_models.Tool:
+    """Builds the RAG retrieval tool on first use.
+
+    RagCorpus construction performs a network RPC, so deferring it keeps
+    cold-start imports cheap — the cost moves to the first request instead of
+    every process start.
+    """
+    # The rag module drags in a large slice of the Vertex SDK; import it here
+    # so cold-start module load stays lightweight.
+    from vertexai import rag
+
+    rag_corpus = rag.RagCorpus(f"projects/qwiklabs-gcp-00-ec45a6172538/locations/${LOCATION}/ragCorpora/4611686018427387904")
+    return generative_models.Tool.from_retrieval(
+        retrieval=rag.Retrieval(
+            source=rag.VertexRagStore(
+                rag_resources=[rag.RagResource(rag_corpus=rag_corpus.name)],
+                rag_retrieval_config=rag.RagRetrievalConfig(
+                    top_k=10,  # Optional
+                    filter=rag.Filter(
+                        vector_distance_threshold=0.5,  # Optional
+                    ),
                 ),
             ),
-        ),
+        )
     )
+
+# Shared generation config; it never changes between requests.
+_GEN_CONFIG = generative_models.GenerationConfig(
+    temperature=0,
+    max_output_tokens=1024,
 )
 
+
+@functools.lru_cache(maxsize=1)
+def _model() -> generative_models.GenerativeModel:
+    """Builds the shared GenerativeModel on first use.
+
+    GenerativeModel.__init__ resolves project, location, and credentials from
+    the global initializer config, so construction must happen after
+    _ensure_init has pointed the SDK at LLM_LOCATION — and only once, since
+    per-call construction is pure setup overhead for a stateless config.
+    """
+    _ensure_init()
+    return generative_models.GenerativeModel(LLM, generation_config=_GEN_CONFIG)
+
+# Semantic cache for rag_search. Queries that are near-duplicates of recent
+# ones (cosine similarity >= threshold on their embeddings) reuse the cached
+# answer instead of paying for retrieval + generation again.
+_SEMANTIC_CACHE_THRESHOLD = 0.95
+_semantic_cache: deque = deque(maxlen=1024)  # (unit embedding, answer) pairs
+_embedding_model = None
+
+# Exact-match tier in front of the semantic cache, keyed by a cheap FNV-1a
+# 64-bit hash. Collision resistance is not needed for an in-process dict, so
+# a cryptographic hash would be wasted cycles here; reserve SHA-256 for any
+# future persistent (e.g. Firestore-backed) query cache. Entries expire after
+# a short TTL so intra-session duplicate retrievals are free while stale
+# answers do not outlive the corpus they came from.
+_EXACT_CACHE_TTL_SECONDS = 300
+_EXACT_CACHE_LIMIT = 1024
+_exact_cache: dict[int, tuple[float, str]] = {}
+
+
+def _fnv1a_64(data: bytes) -> int:
+    """FNV-1a 64-bit hash — fast, non-cryptographic, good enough for a dict key."""
+    h = 0xCBF29CE484222325
+    for byte in data:
+        h = ((h ^ byte) * 0x100000001B3) & 0xFFFFFFFFFFFFFFFF
+    return h
+
+
+def _exact_cache_get(key: int) -> str | None:
+    """Returns the cached answer for a key, expiring entries past the TTL."""
+    hit = _exact_cache.get(key)
+    if hit is None:
+        return None
+    if time.monotonic() - hit[0] < _EXACT_CACHE_TTL_SECONDS:
+        return hit[1]
+    # pop rather than del: a concurrent caller may have expired the same
+    # key already, and that must not surface as a KeyError.
+    _exact_cache.pop(key, None)
+    return None
+
+
+def _exact_cache_set(key: int, answer: str) -> None:
+    """Stores an answer under a key, clearing the cache when it is full."""
+    if len(_exact_cache) >= _EXACT_CACHE_LIMIT:
+        _exact_cache.clear()
+    _exact_cache[key] = (time.monotonic(), answer)
+
+
+def _embed_query(query: str) -> np.ndarray:
+    """Returns the unit-normalized embedding vector for a query."""
+    global _embedding_model
+    if _embedding_model is None:
+        # Imported lazily so the embedding model is only loaded once the
+        # cache is actually exercised.
+        from vertexai.language_models import TextEmbeddingModel
+
+        _embedding_model = TextEmbeddingModel.from_pretrained("text-embedding-004")
+    embedding = np.asarray(
+        _embedding_model.get_embeddings([query])[0].values, dtype=np.float32
+    )
+    return embedding / np.linalg.norm(embedding)
+
+
+def _semantic_cache_get(embedding: np.ndarray) -> str | None:
+    """Returns the cached answer most similar to `embedding`, if close enough."""
+    if not _semantic_cache:
+        return None
+    cached = np.stack([entry[0] for entry in _semantic_cache])
+    similarities = cached @ embedding
+    best = int(np.argmax(similarities))
+    if similarities[best] >= _SEMANTIC_CACHE_THRESHOLD:
+        return _semantic_cache[best][1]
+    return None
+
+
 # Convert Vertex AI RAG tool to LangChain tool for the LangGraph workflow
 @tool
 def rag_search(query: str) -> str:
     """Search through the RAG corpus for relevant information."""
+    # Exact repeats within the TTL skip even the embedding RPC.
+    cache_key = _fnv1a_64(query.encode())
+    cached_answer = _exact_cache_get(cache_key)
+    if cached_answer is not None:
+        return cached_answer
+
+    # Check the semantic cache next; a failure here (e.g. embedding RPC
+    # error) must never break the tool, so fall through to the model call.
+    embedding = None
+    try:
+        embedding = _embed_query(query)
+        cached_answer = _semantic_cache_get(embedding)
+        if cached_answer is not None:
+            return cached_answer
+    except Exception:
+        pass
+
     # Use the Vertex AI RAG tool to retrieve information
-    model = generative_models.GenerativeModel(
-        LLM,  # Using the LLM constant defined above
-        generation_config=generative_models.GenerationConfig(
-            temperature=0,
-            max_output_tokens=1024,
-        )
-    )
-    response = model.generate_content(
+    response = _model().generate_content(
         [generative_models.Content(
-            parts=[generative_models.Part(text=query)]
+            parts=[generative_models.Part.from_text(query)]
         )],
-        tools=[rag_retrieval_tool]
+        tools=[_rag_retrieval_tool()]
     )
-    return response.text
+    answer = response.text
+    _exact_cache_set(cache_key, answer)
+    if embedding is not None:
+        _semantic_cache.append((embedding, answer))
+    return answer
 
 tools = [rag_search]
 
+# The system prompt never changes, so convert it to a Vertex Content object
+# once at import instead of rebuilding (and re-converting) it on every turn.
+_SYSTEM_PROMPT = "You are a helpful AI assistant with access to RAG capabilities. Use the rag_search tool when you need to retrieve specific information from the knowledge base."
+_SYSTEM_CONTENT = generative_models.Content(
+    role="user", parts=[generative_models.Part.from_text(_SYSTEM_PROMPT)]
+)
+
 # 2. Set up the language model with tools
+# Messages are immutable once they enter the graph state, so their Vertex
+# Content conversion can be memoized by object identity. Each agent step then
+# only converts the messages that are new since the previous step instead of
+# re-converting the whole history (O(turns) per step -> O(1)).
+_converted_messages: dict[int, tuple] = {}
+_CONVERTED_CACHE_LIMIT = 4096
+
+
+# Message-type -> Vertex role lookup table; one dict access replaces the
+# per-type if/elif chains for both dict-style and LangChain messages.
+_ROLE_MAP = {"system": "user", "human": "user", "ai": "model"}
+
+
+def _build_content(msg: dict | BaseMessage) -> generative_models.Content | None:
+    """Converts a single LangChain message to a Vertex Content, or None."""
+    if isinstance(msg, dict):
+        msg_type, text = msg["type"], msg["content"]
+    else:
+        msg_type, text = msg.type, msg.content
+    role = _ROLE_MAP.get(msg_type)
+    if role is None:
+        return None
+    return generative_models.Content(
+        role=role, parts=[generative_models.Part.from_text(text)]
+    )
+
+
+def _convert_message(msg: dict | BaseMessage) -> generative_models.Content | None:
+    """Returns the memoized Vertex Content for a message, converting on miss."""
+    key = id(msg)
+    hit = _converted_messages.get(key)
+    # Keep the original message alongside the Content so a recycled id()
+    # (the old object was garbage collected) cannot serve a stale entry.
+    if hit is not None and hit[0] is msg:
+        return hit[1]
+    content = _build_content(msg)
+    if len(_converted_messages) >= _CONVERTED_CACHE_LIMIT:
+        _converted_messages.clear()
+    _converted_messages[key] = (msg, content)
+    return content
+
+
+def _token_handlers(callbacks: Any) -> list[Any]:
+    """Returns the callback handlers that can receive new-token events.
+
+    LangChain passes config["callbacks"] as either a list of handlers or a
+    CallbackManager (whose handlers live on .handlers); unwrap both shapes.
+    """
+    if callbacks is None:
+        return []
+    handlers = getattr(callbacks, "handlers", callbacks)
+    if not isinstance(handlers, list | tuple):
+        handlers = [handlers]
+    return [h for h in handlers if hasattr(h, "on_llm_new_token")]
+
+
+def _chunk_text(chunk: Any) -> str:
+    """Returns the text of a response chunk, or '' when it carries none.
+
+    Streamed chunks holding a function call or only usage metadata raise from
+    .text in the Vertex SDK; that must not abort the stream.
+    """
+    try:
+        return chunk.text
+    except (AttributeError, IndexError, ValueError):
+        return ""
+
+
+def _chunk_function_calls(chunk: Any) -> list[Any]:
+    """Collects function calls from every candidate of a response (or chunk)."""
+    calls: list[Any] = []
+    for candidate in getattr(chunk, "candidates", None) or []:
+        # function_calls is a Candidate property (each Part only carries a
+        # singular function_call).
+        calls.extend(getattr(candidate, "function_calls", None) or [])
+    return calls
+
+
 # This is a custom function that mimics the behavior of ChatVertexAI.bind_tools()
 def get_claude_with_tools(tools):
     """Creates a callable that mimics the behavior of a LangChain LLM with bound tools."""
-    
+
     def invoke_claude(messages, config=None):
         """Invokes Claude with the given messages and tools."""
-        # Convert LangChain messages to Vertex AI format
-        vertex_messages = []
-        
+        # Convert LangChain messages to Vertex AI format, prepending the
+        # pre-built system prompt Content.
+        vertex_messages = [_SYSTEM_CONTENT]
+
         for msg in messages:
-            if isinstance(msg, dict):
-                # Handle dict-style messages
-                if msg["type"] == "system":
-                    vertex_messages.append(generative_models.Content(
-                        role="user", 
-                        parts=[generative_models.Part(text=msg["content"])]
-                    ))
-                elif msg["type"] == "human":
-                    vertex_messages.append(generative_models.Content(
-                        role="user", 
-                        parts=[generative_models.Part(text=msg["content"])]
-                    ))
-                elif msg["type"] == "ai":
-                    vertex_messages.append(generative_models.Content(
-                        role="model", 
-                        parts=[generative_models.Part(text=msg["content"])]
-                    ))
-            else:
-                # Handle LangChain message objects
-                if msg.type == "human":
-                    vertex_messages.append(generative_models.Content(
-                        role="user", 
-                        parts=[generative_models.Part(text=msg.content)]
-                    ))
-                elif msg.type == "ai":
-                    vertex_messages.append(generative_models.Content(
-                        role="model", 
-                        parts=[generative_models.Part(text=msg.content)]
-                    ))
-        
-        # Create the model
-        model = generative_models.GenerativeModel(
-            LLM,
-            generation_config=generative_models.GenerationConfig(
-                temperature=0,
-                max_output_tokens=1024,
-            )
-        )
-        
+            content = _convert_message(msg)
+            if content is not None:
+                vertex_messages.append(content)
+
+
+        # Stream whenever callbacks are attached so tokens reach the client as
+        # they are generated instead of blocking on the full completion.
+        streaming = config is not None and config.get("callbacks") is not None
+
         # Call the Claude model through Vertex AI
-        response = model.generate_content(
+        response = _model().generate_content(
             vertex_messages,
-            tools=[rag_retrieval_tool],
-            stream=config is not None and config.get("callbacks") is not None
+            tools=[_rag_retrieval_tool()],
+            stream=streaming
         )
-        
+
         # Convert the response back to LangChain format
-        if config is not None and config.get("callbacks") is not None and hasattr(response, 'candidates'):
-            # For streaming responses
-            response_text = response.candidates[0].content.parts[0].text
+        if streaming:
+            # generate_content returns an iterator of partial responses when
+            # stream=True; forward each chunk's text to the callbacks and
+            # collect function calls from every chunk, since a tool-calling
+            # turn can emit them before the final chunk.
+            handlers = _token_handlers(config.get("callbacks"))
+            chunks = []
+            function_calls = []
+            for chunk in response:
+                chunk_text = _chunk_text(chunk)
+                if chunk_text:
+                    chunks.append(chunk_text)
+                    for handler in handlers:
+                        handler.on_llm_new_token(chunk_text)
+                function_calls.extend(_chunk_function_calls(chunk))
+            response_text = "".join(chunks)
         else:
             # For non-streaming responses
             response_text = response.text
-        
+            function_calls = _chunk_function_calls(response)
+
         # Create an AIMessage
         ai_message = AIMessage(content=response_text)
-        
-        # Check if there are tool calls in the response
-        if hasattr(response, 'candidates') and response.candidates and hasattr(response.candidates[0].content.parts[0], 'function_calls'):
-            function_calls = response.candidates[0].content.parts[0].function_calls
-            if function_calls:
-                tool_calls = []
-                for function_call in function_calls:
-                    tool_calls.append({
-                        "name": function_call.name,
-                        "arguments": function_call.args
-                    })
-                ai_message.tool_calls = tool_calls
-        
+
+        # Check if there are tool calls in the response. LangChain's ToolNode
+        # expects {"name", "args", "id"} entries with plain-dict args.
+        if function_calls:
+            tool_calls = []
+            for function_call in function_calls:
+                tool_calls.append({
+                    "name": function_call.name,
+                    "args": dict(function_call.args),
+                    "id": str(uuid.uuid4()),
+                })
+            ai_message.tool_calls = tool_calls
+
         return ai_message
-    
+
     return invoke_claude
 
 # Create a callable that mimics a LangChain LLM with bound tools
@@ -171,12 +374,10 @@ def should_continue(state: MessagesState) -> str:
 
 def call_model(state: MessagesState, config: RunnableConfig) -> dict[str, BaseMessage]:
     """Calls the language model and returns the response."""
-    system_message = "You are a helpful AI assistant with access to RAG capabilities. Use the rag_search tool when you need to retrieve specific information from the knowledge base."
-    messages_with_system = [{"type": "system", "content": system_message}] + state[
-        "messages"
-    ]
+    # The system prompt is prepended inside invoke_claude as a cached Content
+    # object, so only the conversation messages are passed through here.
     # Forward the RunnableConfig object to ensure the agent is capable of streaming the response.
-    response = llm(messages_with_system, config)
+    response = llm(state["messages"], config)
     return {"messages": response}
 
 
@@ -28,12 +28,24 @@ import streamlit as st
 import vertexai
 from google.auth.exceptions import DefaultCredentialsError
 from langchain_core.messages import AIMessage, ToolMessage
+from requests.adapters import HTTPAdapter, Retry
 from vertexai.preview import reasoning_engines
 
 from frontend.utils.multimodal_utils import format_content
 
 st.cache_resource.clear()
 
+# Shared HTTP session so feedback and streaming requests reuse pooled
+# connections instead of paying a TCP/TLS handshake per call.
+_session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.3),
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
 
 @st.cache_resource
 def get_remote_agent(remote_agent_engine_id: str) -> Any:
@@ -139,7 +151,7 @@ class Client:
             }
             if self.authenticate_request:
                 headers["Authorization"] = f"Bearer {self.id_token}"
-            requests.post(
+            _session.post(
                 url, data=json.dumps(feedback_dict), headers=headers, timeout=10
             )
         elif self.agent is not None:
@@ -158,7 +170,7 @@ class Client:
             }
             if self.authenticate_request:
                 headers["Authorization"] = f"Bearer {self.id_token}"
-            with requests.post(
+            with _session.post(
                 self.url, json=data, headers=headers, stream=True, timeout=10
             ) as response:
                 for line in response.iter_lines():
@@ -0,0 +1,219 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections.abc import Generator
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app import agent_rag
+
+
+@pytest.fixture(autouse=True)
+def clear_caches() -> Generator[None, None, None]:
+    """Isolate the module-level caches between tests."""
+    agent_rag._exact_cache.clear()
+    agent_rag._semantic_cache.clear()
+    agent_rag._converted_messages.clear()
+    yield
+    agent_rag._exact_cache.clear()
+    agent_rag._semantic_cache.clear()
+    agent_rag._converted_messages.clear()
+
+
+@pytest.fixture
+def fake_clock(monkeypatch: pytest.MonkeyPatch) -> SimpleNamespace:
+    """Replace agent_rag's time module with a controllable monotonic clock."""
+    clock = SimpleNamespace(now=0.0)
+    clock.monotonic = lambda: clock.now
+    monkeypatch.setattr(agent_rag, "time", clock)
+    return clock
+
+
+def test_fnv1a_64_known_vectors() -> None:
+    """The FNV-1a 64-bit hash matches the published reference vectors."""
+    assert agent_rag._fnv1a_64(b"") == 0xCBF29CE484222325
+    assert agent_rag._fnv1a_64(b"a") == 0xAF63DC4C8601EC8C
+    assert agent_rag._fnv1a_64(b"foobar") == 0x85944171F73967E8
+
+
+def test_fnv1a_64_distinguishes_nearby_keys() -> None:
+    """Similar queries hash to distinct 64-bit keys."""
+    assert agent_rag._fnv1a_64(b"query one") != agent_rag._fnv1a_64(b"query two")
+
+
+def test_exact_cache_hit_within_ttl(fake_clock: SimpleNamespace) -> None:
+    """A stored answer is returned while the TTL has not elapsed."""
+    key = agent_rag._fnv1a_64(b"what is the fed funds rate")
+    agent_rag._exact_cache_set(key, "4.33%")
+    fake_clock.now += agent_rag._EXACT_CACHE_TTL_SECONDS - 1
+    assert agent_rag._exact_cache_get(key) == "4.33%"
+
+
+def test_exact_cache_expires_after_ttl(fake_clock: SimpleNamespace) -> None:
+    """An entry older than the TTL is treated as a miss and removed."""
+    key = agent_rag._fnv1a_64(b"stale query")
+    agent_rag._exact_cache_set(key, "old answer")
+    fake_clock.now += agent_rag._EXACT_CACHE_TTL_SECONDS + 1
+    assert agent_rag._exact_cache_get(key) is None
+    assert key not in agent_rag._exact_cache
+
+
+def test_exact_cache_expiry_is_idempotent(fake_clock: SimpleNamespace) -> None:
+    """Expiring the same key twice (racing callers) must not raise."""
+    key = agent_rag._fnv1a_64(b"racy query")
+    agent_rag._exact_cache_set(key, "answer")
+    fake_clock.now += agent_rag._EXACT_CACHE_TTL_SECONDS + 1
+    assert agent_rag._exact_cache_get(key) is None
+    assert agent_rag._exact_cache_get(key) is None
+
+
+def test_exact_cache_clears_when_full(fake_clock: SimpleNamespace) -> None:
+    """Inserting into a full cache drops the old entries instead of growing."""
+    for i in range(agent_rag._EXACT_CACHE_LIMIT):
+        agent_rag._exact_cache_set(i, f"answer {i}")
+    agent_rag._exact_cache_set(agent_rag._EXACT_CACHE_LIMIT, "newest")
+    assert len(agent_rag._exact_cache) == 1
+    assert agent_rag._exact_cache_get(agent_rag._EXACT_CACHE_LIMIT) == "newest"
+
+
+def test_semantic_cache_hit_above_threshold() -> None:
+    """A query embedding close to a cached one returns the cached answer."""
+    cached = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    agent_rag._semantic_cache.append((cached, "cached answer"))
+    near_duplicate = np.array([0.999, 0.0447, 0.0], dtype=np.float32)
+    near_duplicate /= np.linalg.norm(near_duplicate)
+    assert agent_rag._semantic_cache_get(near_duplicate) == "cached answer"
+
+
+def test_semantic_cache_miss_below_threshold() -> None:
+    """An unrelated query embedding does not match any cached entry."""
+    cached = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    agent_rag._semantic_cache.append((cached, "cached answer"))
+    orthogonal = np.array([0.0, 1.0, 0.0], dtype=np.float32)
+    assert agent_rag._semantic_cache_get(orthogonal) is None
+
+
+def test_semantic_cache_empty_returns_none() -> None:
+    """An empty cache is always a miss."""
+    query = np.array([1.0, 0.0], dtype=np.float32)
+    assert agent_rag._semantic_cache_get(query) is None
+
+
+def test_semantic_cache_picks_most_similar_entry() -> None:
+    """The best-matching cached answer wins when several entries exist."""
+    agent_rag._semantic_cache.append(
+        (np.array([1.0, 0.0], dtype=np.float32), "first answer")
+    )
+    agent_rag._semantic_cache.append(
+        (np.array([0.0, 1.0], dtype=np.float32), "second answer")
+    )
+    query = np.array([0.0, 1.0], dtype=np.float32)
+    assert agent_rag._semantic_cache_get(query) == "second answer"
+
+
+def test_build_content_maps_roles() -> None:
+    """Message types map onto the expected Vertex roles."""
+    assert agent_rag._build_content({"type": "human", "content": "hi"}).role == "user"
+    assert agent_rag._build_content({"type": "system", "content": "be brief"}).role == "user"
+    assert agent_rag._build_content({"type": "ai", "content": "hello"}).role == "model"
+
+
+def test_build_content_unknown_type_returns_none() -> None:
+    """Unmapped message types are skipped rather than mis-labelled."""
+    assert agent_rag._build_content({"type": "tool", "content": "result"}) is None
+
+
+def test_convert_message_memoizes_by_identity() -> None:
+    """Converting the same message object twice returns the same Content."""
+    msg = {"type": "human", "content": "what moved the 10Y yield today?"}
+    first = agent_rag._convert_message(msg)
+    second = agent_rag._convert_message(msg)
+    assert first is second
+    assert first.role == "user"
+
+
+def test_convert_message_rejects_stale_id_entry() -> None:
+    """A cache entry left by a garbage-collected object with a recycled id
+    must not be served for a different message."""
+    msg = {"type": "human", "content": "fresh message"}
+    stale_owner = {"type": "ai", "content": "previous occupant"}
+    agent_rag._converted_messages[id(msg)] = (stale_owner, "stale content")
+    content = agent_rag._convert_message(msg)
+    assert content != "stale content"
+    assert content.role == "user"
+    # The rebuilt entry replaces the stale one.
+    assert agent_rag._converted_messages[id(msg)][0] is msg
+
+
+def test_chunk_text_returns_empty_for_textless_chunks() -> None:
+    """Chunks whose .text raises (function-call / metadata-only) yield ''."""
+
+    class TextlessChunk:
+        @property
+        def text(self) -> str:
+            raise ValueError("Part has no text.")
+
+    assert agent_rag._chunk_text(TextlessChunk()) == ""
+    assert agent_rag._chunk_text(SimpleNamespace(text="token")) == "token"
+
+
+def test_chunk_function_calls_reads_candidate_property() -> None:
+    """Function calls are collected from each candidate's function_calls."""
+    call = SimpleNamespace(name="rag_search", args={"query": "cpi yoy"})
+    chunk = SimpleNamespace(candidates=[SimpleNamespace(function_calls=[call])])
+    assert agent_rag._chunk_function_calls(chunk) == [call]
+
+
+def test_chunk_function_calls_handles_empty_chunks() -> None:
+    """Chunks without candidates or calls contribute nothing."""
+    assert agent_rag._chunk_function_calls(SimpleNamespace()) == []
+    empty = SimpleNamespace(candidates=[SimpleNamespace(function_calls=[])])
+    assert agent_rag._chunk_function_calls(empty) == []
+
+
+def test_invoke_claude_emits_langchain_shaped_tool_calls(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Tool calls surface on the AIMessage as {"name", "args", "id"} dicts."""
+    call = SimpleNamespace(name="rag_search", args={"query": "cpi yoy"})
+    response = SimpleNamespace(
+        text="", candidates=[SimpleNamespace(function_calls=[call])]
+    )
+    fake_model = SimpleNamespace(generate_content=lambda *args, **kwargs: response)
+    monkeypatch.setattr(agent_rag, "_model", lambda: fake_model)
+    monkeypatch.setattr(agent_rag, "_rag_retrieval_tool", lambda: object())
+
+    llm = agent_rag.get_claude_with_tools(agent_rag.tools)
+    message = llm([{"type": "human", "content": "what is CPI YoY?"}])
+
+    assert len(message.tool_calls) == 1
+    tool_call = message.tool_calls[0]
+    assert tool_call["name"] == "rag_search"
+    assert tool_call["args"] == {"query": "cpi yoy"}
+    assert tool_call["id"]
+
+
+def test_convert_message_cache_is_bounded() -> None:
+    """The conversion cache resets instead of growing without limit."""
+    agent_rag._converted_messages.clear()
+    messages = [
+        {"type": "human", "content": f"message {i}"}
+        for i in range(agent_rag._CONVERTED_CACHE_LIMIT)
+    ]
+    for msg in messages:
+        agent_rag._convert_message(msg)
+    agent_rag._convert_message({"type": "human", "content": "one more"})
+    assert len(agent_rag._converted_messages) == 1